@@ -3,10 +3,30 @@ Helps students learn from class transcripts through conversational AI tutoring
 """
 
 import streamlit as st
-import anthropic
 import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
+# Where transcript files live: bundled with the repo + uploaded at runtime
+TRANSCRIPTS_DIR = Path("transcripts")
+UPLOAD_DIR = Path("data/uploads")
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+# On-disk cache of extracted pdf/docx text, keyed by content hash, so a
+# container restart (which wipes st.cache_data) doesn't re-parse everything
+CACHE_DIR = Path("data/cache")
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Cap the combined transcript context so the system prompt stays within
+# budget. The cap is expressed as a token budget (English prose averages
+# ~4 chars/token) so it tracks what the model actually consumes; Claude's
+# 200K-token window leaves ample room for the conversation on top.
+MAX_TRANSCRIPT_TOKENS = 8_000
+MAX_TRANSCRIPT_CHARS = MAX_TRANSCRIPT_TOKENS * 4
+
 # Page configuration
 st.set_page_config(
     page_title="🎓 AI Tutor Assistant",
@@ -14,50 +34,314 @@ st.set_page_config(
     layout="wide"
 )
 
+# Keep the last N exchanges; a bounded deque trims old turns in O(1) at
+# append time and caps both history rendering and the per-turn API payload
+MAX_CONVERSATION_EXCHANGES = 20
+
 # Initialize session state
 if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "uploaded_files" not in st.session_state:
-    st.session_state.uploaded_files = []
-if "transcript_content" not in st.session_state:
-    st.session_state.transcript_content = ""
-
-# Initialize Anthropic client
-try:
-    client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-    model = "claude-3-5-sonnet-20241022"
-except:
-    client = None
+    st.session_state.messages = deque(maxlen=2 * MAX_CONVERSATION_EXCHANGES)
+
+model = "claude-3-5-sonnet-20241022"
+
+
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """Return a shared Anthropic client so its HTTP connection pool
+    (and TCP/TLS sessions) survive Streamlit reruns instead of being
+    rebuilt on every script run. The import lives here too, so browsing
+    or managing files never pays the SDK's import cost."""
+    try:
+        import anthropic
+        return anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+    except:
+        return None
+
+
+@st.cache_data(show_spinner=False)
+def _list_files(dirs_mtime_ns):
+    """Scan the transcript directories, stat()ing each file exactly once.
+
+    dirs_mtime_ns is the cache key: adding or removing a file bumps the
+    parent directory's mtime, so the listing invalidates precisely when the
+    file set changes instead of on a wall-clock TTL.
+    """
+    files = []
+    for directory, source in ((TRANSCRIPTS_DIR, "bundled"), (UPLOAD_DIR, "uploaded")):
+        if not directory.exists():
+            continue
+        entries = []
+        # os.scandir serves is_file()/stat() from the directory read itself,
+        # so this is one pass instead of a stat syscall per Path method
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                info = entry.stat()
+                entries.append({
+                    "name": entry.name,
+                    "path": entry.path,
+                    "size": info.st_size,
+                    "mtime_ns": info.st_mtime_ns,
+                    # Pre-formatted here because strftime is slow and this
+                    # dict is cached; rows then render it as a plain string
+                    "modified_str": datetime.fromtimestamp(
+                        info.st_mtime).strftime("%b %d, %Y %I:%M %p"),
+                    "source": source,
+                })
+        files.extend(sorted(entries, key=lambda f: f["name"]))
+    return files
+
+
+def get_all_files():
+    """Return metadata for all bundled and uploaded transcript files."""
+    return _list_files(tuple(
+        d.stat().st_mtime_ns if d.exists() else 0
+        for d in (TRANSCRIPTS_DIR, UPLOAD_DIR)
+    ))
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def read_file_content(filepath, mtime_ns, size, max_chars=None):
+    """Extract text from a transcript file.
+
+    Cached on (filepath, mtime_ns, size) so Streamlit reruns don't re-read
+    or re-parse unchanged files; the extra args exist only to key the cache.
+    max_chars is a budget hint: PDF extraction stops once it is reached, so
+    a 500-page PDF doesn't get fully parsed just to be truncated later.
+    """
+    path = Path(filepath)
+    suffix = path.suffix.lower()
+    try:
+        if suffix == ".docx":
+            return _extract_cached(path, max_chars, _extract_docx)
+        elif suffix == ".pdf":
+            return _extract_cached(path, max_chars, _extract_pdf)
+        else:
+            # Sized read: don't pull a huge .txt into memory just to have
+            # the concatenation step throw away everything past the budget
+            with path.open("r", encoding="utf-8", errors="ignore") as f:
+                return f.read(max_chars) if max_chars is not None else f.read()
+    except Exception as e:
+        return f"[Could not read {path.name}: {e}]"
+
+
+def _extract_cached(path, max_chars, extract):
+    """Run extract() with a persistent cache under data/cache.
+
+    The key is the sha256 of the file content (plus the truncation budget,
+    which changes the output), so unchanged files are extracted exactly once
+    per process lifetime *and* across container restarts.
+    """
+    import hashlib
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    budget = "full" if max_chars is None else str(max_chars)
+    cache_file = CACHE_DIR / f"{digest}-{budget}.txt"
+    if cache_file.exists():
+        return cache_file.read_text(encoding="utf-8")
+    text = extract(path, max_chars)
+    try:
+        cache_file.write_text(text, encoding="utf-8")
+    except OSError:
+        pass  # cache is best-effort; a full disk shouldn't break reads
+    return text
+
+
+def _extract_docx(path, max_chars):
+    from docx import Document
+    doc = Document(str(path))
+    parts = []
+    total = 0
+    for p in doc.paragraphs:
+        parts.append(p.text)
+        total += len(p.text) + 1
+        if max_chars is not None and total >= max_chars:
+            break
+    return "\n".join(parts)
+
+
+def _extract_pdf(path, max_chars):
+    try:
+        # pypdfium2 wraps PDFium (C), extracting text several times faster
+        # than pure-Python readers; fall back to pypdf when unavailable
+        import pypdfium2 as pdfium
+    except ImportError:
+        return _extract_pdf_pypdf(path, max_chars)
+    pdf = pdfium.PdfDocument(str(path))
+    try:
+        parts = []
+        total = 0
+        for page in pdf:
+            text = page.get_textpage().get_text_range()
+            parts.append(text)
+            total += len(text) + 1
+            if max_chars is not None and total >= max_chars:
+                break
+        return "\n".join(parts)
+    finally:
+        pdf.close()
+
+
+def _extract_pdf_pypdf(path, max_chars):
+    from pypdf import PdfReader
+    reader = PdfReader(str(path))
+    parts = []
+    total = 0
+    for page in reader.pages:
+        text = page.extract_text() or ""
+        parts.append(text)
+        total += len(text) + 1
+        if max_chars is not None and total >= max_chars:
+            break
+    return "\n".join(parts)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _concat_transcript_content(signature):
+    """Concatenate transcripts up to MAX_TRANSCRIPT_CHARS.
+
+    signature is a tuple of (path, mtime_ns, size) per file and doubles as
+    the cache key, so the large string is built once per file-set version.
+    """
+    if not signature:
+        return ""
+    # Extract files in parallel: disk reads release the GIL and cold-cache
+    # pdf/docx parsing is I/O-heavy, so warm-up cost is the slowest file
+    # rather than the sum. Each file is capped at the full budget; the
+    # assembly loop below enforces the overall limit deterministically.
+    with ThreadPoolExecutor(max_workers=min(8, len(signature))) as ex:
+        texts = list(ex.map(
+            lambda s: read_file_content(s[0], s[1], s[2],
+                                        max_chars=MAX_TRANSCRIPT_CHARS),
+            signature,
+        ))
+    parts = []
+    total = 0
+    for (filepath, mtime_ns, size), text in zip(signature, texts):
+        if total >= MAX_TRANSCRIPT_CHARS:
+            break
+        chunk = f"--- {Path(filepath).name} ---\n{text}"[: MAX_TRANSCRIPT_CHARS - total]
+        parts.append(chunk)
+        total += len(chunk)
+    return "\n\n".join(parts)
+
+
+def get_all_transcript_content():
+    """Return the combined transcript context for the system prompt."""
+    signature = tuple(
+        (f["path"], f["mtime_ns"], f["size"])
+        for f in get_all_files()
+    )
+    return _concat_transcript_content(signature)
+
+
+# Static halves of the tutor prompt, defined once at import time; the
+# transcript is joined between them in a single allocation
+_PROMPT_PREFIX = """You are an expert AI tutor helping students learn from their class materials.
+
+Class Transcript Context:
+"""
+
+_PROMPT_SUFFIX = """
+
+Your role:
+- Explain concepts clearly with examples
+- Generate quizzes to test understanding
+- Provide detailed explanations when asked
+- Reference the transcript content when relevant
+- Be encouraging and supportive
+"""
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_system_prompt(transcript_content):
+    """Build the tutor system prompt around the transcript context.
+
+    Cached on the transcript content itself, so the ~35 KB prompt string is
+    assembled once per transcript version instead of once per chat turn.
+    """
+    return "".join((_PROMPT_PREFIX, transcript_content, _PROMPT_SUFFIX))
+
+
+@st.fragment
+def _file_manager(files):
+    """Render the transcript list as one table plus one action area.
+
+    A dataframe is a single widget however many files there are; the
+    per-file actions hang off one selectbox instead of 3N buttons, so
+    widget count stays O(1) as the transcript folder grows. As a fragment,
+    selecting a file or toggling the preview reruns only this block —
+    deletes still st.rerun() so the whole app sees the new file set.
+    """
+    st.dataframe(
+        [{"File": f["name"], "Source": f["source"],
+          "Size (KB)": round(f["size"] / 1024, 1),
+          "Modified": f["modified_str"]} for f in files],
+        hide_index=True, use_container_width=True,
+    )
+    selected = st.selectbox("Select a file", [f["name"] for f in files],
+                            key="_file_select")
+    f = next(f for f in files if f["name"] == selected)
+    col1, col2, col3 = st.columns(3)
+    if col1.toggle("👁️ Preview", key="_file_preview"):
+        st.caption(read_file_content(f["path"], f["mtime_ns"], f["size"],
+                                     max_chars=MAX_TRANSCRIPT_CHARS)[:1000])
+    # Two-step download: bytes are read once on Prepare, not on every
+    # manager rerun while a file happens to be selected
+    if col2.button("⬇️ Prepare download", key="_file_prepare"):
+        st.session_state._dl = (f["path"], Path(f["path"]).read_bytes())
+    dl = st.session_state.get("_dl")
+    if dl and dl[0] == f["path"]:
+        col2.download_button("⬇️ Download", data=dl[1],
+                             file_name=f["name"], key="_file_download")
+    if f["source"] == "uploaded" and col3.button("🗑️ Delete", key="_file_delete"):
+        Path(f["path"]).unlink(missing_ok=True)
+        st.rerun()
+
 
 # Sidebar for file uploads
 with st.sidebar:
     st.header("📁 Files")
     st.caption("Files to use as context for learning")
-    
-    uploaded_file = st.file_uploader(
-        "Upload class transcript",
-        type=["txt", "docx", "pdf"],
-        help="Upload your class transcripts for AI analysis"
-    )
-    
-    if uploaded_file:
-        if uploaded_file not in st.session_state.uploaded_files:
-            st.session_state.uploaded_files.append(uploaded_file)
-            # Read the file content
-            try:
-                st.session_state.transcript_content = uploaded_file.read().decode("utf-8")
-                st.success(f"✅ {uploaded_file.name} loaded")
-            except:
-                st.session_state.transcript_content = uploaded_file.read()
-                st.success(f"✅ {uploaded_file.name} loaded")
-    
-    # Show uploaded files
-    if st.session_state.uploaded_files:
+
+    # The form defers the save until an explicit submit, so unrelated
+    # sidebar reruns never re-enter the write path, and clear_on_submit
+    # resets the uploader so the same file isn't rewritten on later reruns
+    with st.form("upload_form", clear_on_submit=True):
+        new_files = st.file_uploader(
+            "Upload class transcript",
+            type=["txt", "docx", "pdf"],
+            accept_multiple_files=True,
+            help="Upload your class transcripts for AI analysis"
+        )
+        if st.form_submit_button("Upload") and new_files:
+            for uf in new_files:
+                # Stream to a temp file and rename into place: no full copy of
+                # the upload in RAM, and no half-written file if we crash mid-save
+                tmp = UPLOAD_DIR / (uf.name + ".tmp")
+                with open(tmp, "wb") as fout:
+                    shutil.copyfileobj(uf, fout, length=1 << 20)
+                    fout.flush()
+                    # fsync before the rename so a crash can't surface an
+                    # empty-but-renamed transcript
+                    os.fsync(fout.fileno())
+                os.replace(tmp, UPLOAD_DIR / uf.name)
+            st.success(f"✅ {len(new_files)} file(s) loaded")
+
+    # Show loaded files — one listing call feeds both the stats line and
+    # the rows, with a single pass to split bundled vs uploaded counts
+    files = get_all_files()
+    if files:
         st.divider()
-        st.subheader("Loaded Files:")
-        for f in st.session_state.uploaded_files:
-            st.text(f"📄 {f.name}")
-    
+        # Collapsed by default; the manager stays out of the way (and out
+        # of the browser's layout work) unless the user opens it
+        with st.expander(f"📁 Loaded Files ({len(files)})", expanded=False):
+            bundled = sum(1 for f in files if f["source"] == "bundled")
+            total_kb = sum(f["size"] for f in files) / 1024
+            st.caption(f"{bundled} bundled · {len(files) - bundled} uploaded"
+                       f" · {total_kb:.1f} KB total")
+            _file_manager(files)
+
     st.divider()
     st.markdown("""
     ### 💡 Example prompts:
@@ -71,77 +355,94 @@ with st.sidebar:
 st.title("🎓 AI Tutor Assistant")
 st.caption("Learn from your class transcripts with AI-powered explanations and quizzes")
 
-# Display chat history
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-# Chat input
-if prompt := st.chat_input("Ask anything about your class materials. Type @ for sources and / for shortcuts."):
-    # Add user message to chat
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    
-    with st.chat_message("user"):
-        st.markdown(prompt)
-    
-    # Generate AI response
-    with st.chat_message("assistant"):
-        if client and st.session_state.transcript_content:
-            # Create system prompt with transcript context
-            system_prompt = f"""You are an expert AI tutor helping students learn from their class materials.
-            
-Class Transcript Context:
-{st.session_state.transcript_content[:5000]}
 
-Your role:
-- Explain concepts clearly with examples
-- Generate quizzes to test understanding
-- Provide detailed explanations when asked
-- Reference the transcript content when relevant
-- Be encouraging and supportive
-"""
-            
-            try:
-                with st.spinner("Thinking..."):
-                    message = client.messages.create(
+@st.fragment
+def _chat_area():
+    """Chat history, input and response streaming.
+
+    Runs as a fragment so a chat turn reruns only this block — the sidebar
+    file scan and uploader don't re-execute per message, and streaming
+    reruns stay scoped to the conversation.
+    """
+    # Display chat history
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    # Chat input
+    if prompt := st.chat_input("Ask anything about your class materials. Type @ for sources and / for shortcuts."):
+        # Add user message to chat
+        st.session_state.messages.append({"role": "user", "content": prompt})
+
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # Generate AI response
+        with st.chat_message("assistant"):
+            client = get_client()
+            transcript_content = get_all_transcript_content()
+            if client and transcript_content:
+                system_prompt = build_system_prompt(transcript_content)
+
+                # The deque evicts one message at a time, so once the cap is
+                # hit the oldest exchange is left half-trimmed and history
+                # would start with an assistant message — which the Messages
+                # API rejects. Drop leading messages until a user turn leads.
+                history = list(st.session_state.messages)
+                while history and history[0]["role"] != "user":
+                    history.pop(0)
+
+                try:
+                    # Stream tokens as they arrive instead of blocking on the
+                    # full response, so the UI renders while bytes are in flight
+                    # Mark the (byte-stable) transcript prompt as cacheable so
+                    # the API reuses its prefix across turns instead of
+                    # re-processing ~32 KB of transcript on every message
+                    with client.messages.stream(
                         model=model,
                         max_tokens=2048,
-                        system=system_prompt,
+                        system=[{
+                            "type": "text",
+                            "text": system_prompt,
+                            "cache_control": {"type": "ephemeral"},
+                        }],
                         messages=[
                             {"role": m["role"], "content": m["content"]}
-                            for m in st.session_state.messages
+                            for m in history
                         ]
-                    )
-                    response = message.content[0].text
-                    st.markdown(response)
+                    ) as stream:
+                        response = st.write_stream(stream.text_stream)
                     st.session_state.messages.append({"role": "assistant", "content": response})
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-                st.info("💡 Make sure to set your ANTHROPIC_API_KEY in the app settings")
-        elif not st.session_state.transcript_content:
-            response = "Please upload a class transcript first using the sidebar. I'll help you learn from it!"
-            st.info(response)
-            st.session_state.messages.append({"role": "assistant", "content": response})
-        else:
-            response = "Please configure your ANTHROPIC_API_KEY to use the AI tutor."
-            st.warning(response)
-            st.session_state.messages.append({"role": "assistant", "content": response})
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+                    st.info("💡 Make sure to set your ANTHROPIC_API_KEY in the app settings")
+            elif not transcript_content:
+                response = "Please upload a class transcript first using the sidebar. I'll help you learn from it!"
+                st.info(response)
+                st.session_state.messages.append({"role": "assistant", "content": response})
+            else:
+                response = "Please configure your ANTHROPIC_API_KEY to use the AI tutor."
+                st.warning(response)
+                st.session_state.messages.append({"role": "assistant", "content": response})
 
-# Welcome message if no chat history
-if not st.session_state.messages:
-    st.markdown("""
-    ### 👋 Welcome to AI Tutor Assistant!
-    
-    This AI-powered tutor helps you:
-    - 📚 **Understand concepts** from your class transcripts
-    - 📝 **Test your knowledge** with interactive quizzes
-    - 💡 **Get explanations** with real-world examples
-    - 🎯 **Focus on key topics** from your classes
-    
-    **To get started:**
-    1. Upload your class transcript using the sidebar
-    2. Ask questions about the material
-    3. Request quizzes to test your understanding
-    
-    Try asking: *"Explain the main concepts from this transcript"* or *"Quiz me on the key topics"*
-    """)
+    # Welcome message if no chat history
+    if not st.session_state.messages:
+        st.markdown("""
+        ### 👋 Welcome to AI Tutor Assistant!
+
+        This AI-powered tutor helps you:
+        - 📚 **Understand concepts** from your class transcripts
+        - 📝 **Test your knowledge** with interactive quizzes
+        - 💡 **Get explanations** with real-world examples
+        - 🎯 **Focus on key topics** from your classes
+
+        **To get started:**
+        1. Upload your class transcript using the sidebar
+        2. Ask questions about the material
+        3. Request quizzes to test your understanding
+
+        Try asking: *"Explain the main concepts from this transcript"* or *"Quiz me on the key topics"*
+        """)
+
+
+_chat_area()